@@ -0,0 +1,264 @@
+"""
+Notion と Spotify の API を扱う共通処理
+"""
+
+import os
+import re
+from dotenv import load_dotenv
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+import orjson
+import ijson
+import base64
+import time
+from types import MappingProxyType
+
+# 環境ファイル関連
+load_dotenv()
+SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
+SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
+NOTION_API_KEY = os.getenv("NOTION_API_KEY")
+DATABASE_ID = os.getenv("DATABASE_ID")
+
+headers = MappingProxyType(
+    {
+        "Notion-Version": "2022-06-28",
+        "Authorization": "Bearer " + NOTION_API_KEY,
+        "Content-Type": "application/json",
+    }
+)
+
+# API のURL
+NOTION_QUERY_URL = f"https://api.notion.com/v1/databases/{DATABASE_ID}/query"
+NOTION_PAGE_URL = "https://api.notion.com/v1/pages/"
+SPOTIFY_TOKEN_URL = "https://accounts.spotify.com/api/token"
+SPOTIFY_TRACKS_URL = "https://api.spotify.com/v1/tracks"
+
+# Spotify のアクセストークンのキャッシュ先
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "spotify2notion")
+TOKEN_CACHE_PATH = os.path.join(CACHE_DIR, "token.json")
+
+# Spotify のトラックURLからトラックIDを取り出す (?si= などのクエリは含めない)
+TRACK_RE = re.compile(r"/track/([A-Za-z0-9]{22})")
+
+# 同時に処理するページ数
+MAX_WORKERS = 8
+# Spotify API で一度に取得できるトラック数の上限
+SPOTIFY_TRACKS_PER_REQUEST = 50
+
+
+def create_session():
+    """
+    接続をプールし、一時的なエラーをリトライするセッションを作成する
+    """
+    session = requests.Session()
+    retry = Retry(
+        total=5,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET", "POST", "PATCH"],
+        # リトライし尽くしたときは例外にせず、最後のレスポンスを返す
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32, max_retries=retry)
+    session.mount("https://", adapter)
+    return session
+
+
+# ホストごとにセッションを使い回して TCP/TLS ハンドシェイクを省く
+notion_session = create_session()
+notion_session.headers.update(headers)
+spotify_session = create_session()
+
+
+def iter_notion_pages():
+    """
+    Notion データベースのページを取得できた順に 1 件ずつ返す
+    レスポンスはダウンロードしながら解析し、読み終えたページから渡す
+    """
+    has_more = True
+    start_cursor = None
+
+    # ペイロードの設定
+    payload = {"page_size": 100}
+
+    while has_more:
+        if start_cursor:
+            payload["start_cursor"] = start_cursor
+
+        has_more = False
+        start_cursor = None
+
+        # データベースクエリを送信
+        with notion_session.post(
+            NOTION_QUERY_URL, data=orjson.dumps(payload), stream=True
+        ) as response:
+            response.raise_for_status()
+            # gzip などで圧縮されたレスポンスも展開しながら読む
+            response.raw.decode_content = True
+
+            builder = None
+            for prefix, event, value in ijson.parse(response.raw, use_float=True):
+                if prefix == "results.item" and event == "start_map":
+                    builder = ijson.ObjectBuilder()
+                if builder is not None:
+                    builder.event(event, value)
+                    # 読み終えたアイテムをすぐに呼び出し元へ渡す
+                    if prefix == "results.item" and event == "end_map":
+                        yield builder.value
+                        builder = None
+                # ページネーションのためのカーソルを更新
+                elif prefix == "has_more":
+                    has_more = value
+                elif prefix == "next_cursor":
+                    start_cursor = value
+
+
+def extract_track_id(item):
+    """
+    NotionのページからSpotifyのトラックIDを抽出
+    """
+    try:
+        url = item["properties"]["URL"]["url"]
+        if url and (m := TRACK_RE.search(url)):
+            return m.group(1)
+    except KeyError:
+        print("URL property not found in item:", item)
+    return None
+
+
+def write_cache_file(path, data):
+    """
+    キャッシュファイルに JSON を書き込む
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # 書き込み途中のファイルを読まないよう、一時ファイル経由で置き換える
+    # トークンを含むので本人以外は読めないように作成する
+    tmp_path = path + ".tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with open(fd, "wb") as f:
+        f.write(orjson.dumps(data))
+    os.replace(tmp_path, path)
+
+
+def load_cached_token(client_id):
+    """
+    キャッシュ済みの Spotify アクセストークンが有効ならそれを返す
+    """
+    try:
+        with open(TOKEN_CACHE_PATH, "rb") as f:
+            cache = orjson.loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+    # 別のクライアントのトークンや期限切れ間近のトークンは使わない
+    if cache.get("client_id") != client_id:
+        return None
+    if time.time() < cache.get("expires_at", 0) - 60:
+        return cache.get("access_token")
+    return None
+
+
+def save_cached_token(client_id, access_token, expires_in):
+    """
+    Spotify アクセストークンをクライアントIDと有効期限とともにキャッシュする
+    """
+    cache = {
+        "client_id": client_id,
+        "access_token": access_token,
+        "expires_at": time.time() + expires_in,
+    }
+    write_cache_file(TOKEN_CACHE_PATH, cache)
+
+
+def clear_cached_token():
+    """
+    キャッシュ済みの Spotify アクセストークンを削除する
+    """
+    try:
+        os.remove(TOKEN_CACHE_PATH)
+    except FileNotFoundError:
+        pass
+
+
+def get_spotify_token(client_id, client_secret):
+    """
+    Spotify API からアクセストークンを取得する
+    有効なキャッシュがあればそれを使う
+    """
+
+    cached_token = load_cached_token(client_id)
+    if cached_token:
+        return cached_token
+
+    auth_str = f"{client_id}:{client_secret}"
+    b64_auth_str = base64.b64encode(auth_str.encode()).decode()
+    headers = {
+        "Authorization": f"Basic {b64_auth_str}",
+        "Content-Type": "application/x-www-form-urlencoded",
+    }
+    data = {"grant_type": "client_credentials"}
+    response = spotify_session.post(SPOTIFY_TOKEN_URL, headers=headers, data=data)
+    if response.status_code == 200:
+        token_data = orjson.loads(response.content)
+        access_token = token_data.get("access_token")
+        try:
+            save_cached_token(
+                client_id, access_token, token_data.get("expires_in", 3600)
+            )
+        except OSError as e:
+            print("Failed to cache Spotify token:", e)
+        return access_token
+    else:
+        print("Spotify token request failed:", response.status_code, response.text)
+        return None
+
+
+def get_album_arts(track_ids, token):
+    """
+    Spotify API から複数トラックのアルバムアートをまとめて取得する
+    トラックIDからアルバムアートのURLへの辞書を返す
+    """
+
+    headers = {"Authorization": f"Bearer {token}"}
+    album_arts = {}
+    for i in range(0, len(track_ids), SPOTIFY_TRACKS_PER_REQUEST):
+        chunk = track_ids[i : i + SPOTIFY_TRACKS_PER_REQUEST]
+        params = {"ids": ",".join(chunk)}
+        response = spotify_session.get(
+            SPOTIFY_TRACKS_URL, headers=headers, params=params
+        )
+        if response.status_code != 200:
+            print("Spotify tracks request failed:", response.status_code, response.text)
+            # 無効になったトークンを次回の実行で使わないようにする
+            if response.status_code == 401:
+                clear_cached_token()
+            continue
+
+        # 存在しないトラックIDに対しては null が返る
+        for track in orjson.loads(response.content).get("tracks", []):
+            if not track:
+                continue
+            images = track.get("album", {}).get("images") or [{}]
+            if images[0].get("url"):
+                album_arts[track["id"]] = images[0]["url"]
+    return album_arts
+
+
+def add_cover_image_to_notion_page(page_id, album_art_url):
+    """
+    Notion のページにカバー画像を設定する
+    """
+    # カバー画像を変更するリクエストのボディ
+    update_data = {"cover": {"type": "external", "external": {"url": album_art_url}}}
+    # ページIDを使ってカバー画像を変更するリクエストを送信
+    update_url = NOTION_PAGE_URL + page_id
+    update_response = notion_session.patch(update_url, data=orjson.dumps(update_data))
+
+    if update_response.status_code == 200:
+        print(f"Page {page_id} updated successfully")
+    else:
+        print(
+            f"Failed to update page {page_id}: {update_response.status_code}, {update_response.text}"
+        )